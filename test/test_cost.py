@@ -108,7 +108,11 @@ from torchrl.objectives import (
     TD3Loss,
 )
 from torchrl.objectives.common import add_random_module, LossModule
-from torchrl.objectives.deprecated import DoubleREDQLoss_deprecated, REDQLoss_deprecated
+from torchrl.objectives.deprecated import (
+    _BmmEnsembleQ,
+    DoubleREDQLoss_deprecated,
+    REDQLoss_deprecated,
+)
 from torchrl.objectives.redq import REDQLoss
 from torchrl.objectives.reinforce import ReinforceLoss
 from torchrl.objectives.utils import (
@@ -6444,6 +6448,20 @@ class TestREDQ(LossModuleTestBase):
         )
         return qvalue.to(device)
 
+    def _create_mock_mlp_qvalue(
+        self,
+        batch=2,
+        obs_dim=3,
+        action_dim=4,
+        device="cpu",
+        observation_key="observation",
+        action_key="action",
+    ):
+        # an MLP critic is evaluated with batched matmuls by REDQLoss_deprecated
+        module = MLP(in_features=obs_dim + action_dim, out_features=1, num_cells=[8, 8])
+        qvalue = ValueOperator(module=module, in_keys=[observation_key, action_key])
+        return qvalue.to(device)
+
     def _create_mock_common_layer_setup(
         self, n_obs=3, n_act=4, ncells=4, batch=2, n_hidden=2
     ):
@@ -6935,6 +6953,425 @@ class TestREDQ(LossModuleTestBase):
                 raise NotImplementedError(k)
             loss_fn.zero_grad()
 
+    @pytest.mark.parametrize("delay_qvalue", (True, False))
+    @pytest.mark.parametrize("seq", (True, False))
+    @pytest.mark.parametrize("qvalue_net", ("mlp", "sequential_nobias"))
+    @pytest.mark.parametrize("device", get_default_devices())
+    def test_redq_deprecated_bmm_ensemble(self, delay_qvalue, seq, qvalue_net, device):
+        torch.manual_seed(self.seed)
+        if seq:
+            td = self._create_seq_mock_data_redq(device=device)
+        else:
+            td = self._create_mock_data_redq(device=device)
+        actor = self._create_mock_actor(device=device)
+        if qvalue_net == "mlp":
+            qvalue = self._create_mock_mlp_qvalue(device=device)
+        else:
+            # a plain sequential reads a single input
+            qvalue = ValueOperator(
+                nn.Sequential(
+                    nn.Linear(3, 8, bias=False), nn.Tanh(), nn.Linear(8, 1, bias=False)
+                ),
+                in_keys=["observation"],
+                out_keys=["state_action_value"],
+            ).to(device)
+        loss_class = DoubleREDQLoss_deprecated if delay_qvalue else REDQLoss_deprecated
+        loss_fn = loss_class(
+            actor_network=actor,
+            qvalue_network=qvalue,
+            num_qvalue_nets=4,
+            loss_function="l2",
+            delay_qvalue=delay_qvalue,
+        )
+        assert isinstance(loss_fn._vmap_qvalue_networkN0, _BmmEnsembleQ)
+
+        # the batched matmul must match the vmap execution
+        vmap_qvalue_network = _vmap_func(loss_fn.qvalue_network, (None, 0))
+        td_q = td.select(*loss_fn.qvalue_network.in_keys)
+        expected = vmap_qvalue_network(td_q.clone(), loss_fn.qvalue_network_params)
+        result = loss_fn._vmap_qvalue_networkN0(td_q, loss_fn.qvalue_network_params)
+        assert result.batch_size == expected.batch_size == (4, *td.shape)
+        result_value = result.get("state_action_value")
+        expected_value = expected.get("state_action_value")
+        assert result_value is not None and expected_value is not None
+        torch.testing.assert_close(result_value, expected_value)
+
+        if delay_qvalue:
+            SoftUpdate(loss_fn, eps=0.5)
+        loss = loss_fn(td)
+        assert td.get("td_error").shape == td.shape
+        sum(item for key, item in loss.items() if key.startswith("loss_")).backward()
+        for p in loss_fn.qvalue_network_params.values(True, True):
+            if isinstance(p, nn.Parameter):
+                assert p.grad is not None and p.grad.norm() > 0
+        if delay_qvalue:
+            for p in loss_fn.target_qvalue_network_params.values(True, True):
+                assert p.grad is None
+
+    @pytest.mark.parametrize("variant", ["subclass", "weight_norm", "hook"])
+    def test_redq_deprecated_bmm_ensemble_fallback(self, variant):
+        class ScaledMLP(MLP):
+            def forward(self, *inputs):
+                return 10 * super().forward(*inputs)
+
+        assert _BmmEnsembleQ.from_module(self._create_mock_mlp_qvalue()) is not None
+        if variant == "subclass":
+            net = ScaledMLP(in_features=3 + 4, out_features=1, num_cells=[8, 8])
+        else:
+            net = MLP(in_features=3 + 4, out_features=1, num_cells=[8, 8])
+            if variant == "weight_norm":
+                torch.nn.utils.weight_norm(net[0])
+            else:
+                net.register_forward_hook(lambda module, args, out: out)
+        qvalue = ValueOperator(net, in_keys=["observation", "action"])
+        # networks that do not reduce to plain linear layers fall back on vmap
+        assert _BmmEnsembleQ.from_module(qvalue) is None
+
+        torch.manual_seed(self.seed)
+        td = self._create_mock_data_redq()
+        loss_fn = REDQLoss_deprecated(
+            actor_network=self._create_mock_actor(),
+            qvalue_network=qvalue,
+            num_qvalue_nets=4,
+            loss_function="l2",
+            delay_qvalue=False,
+        )
+        assert loss_fn._bmm_qvalue_network is None
+        loss = loss_fn(td)
+        assert loss["loss_qvalue"].isfinite()
+
+    @pytest.mark.parametrize("updater", ["soft", "hard"])
+    def test_redq_deprecated_target_leaves(self, updater):
+        torch.manual_seed(self.seed)
+        td = self._create_mock_data_redq()
+        qvalue = self._create_mock_mlp_qvalue()
+        loss_fn = DoubleREDQLoss_deprecated(
+            actor_network=self._create_mock_actor(),
+            qvalue_network=qvalue,
+            num_qvalue_nets=4,
+            loss_function="l2",
+        )
+        assert loss_fn._bmm_qvalue_network is not None
+        if updater == "soft":
+            upd = SoftUpdate(loss_fn, eps=0.5)
+        else:
+            upd = HardUpdate(loss_fn, value_network_update_interval=1)
+        optim = torch.optim.SGD(loss_fn.parameters(), lr=0.1)
+        vmap_qvalue_network = _vmap_func(loss_fn.qvalue_network, (None, 0))
+        td_q = td.select(*qvalue.in_keys)
+
+        def check_target(idx=None):
+            # the cached leaves must follow the target parameters
+            if idx is None:
+                idx = torch.tensor([0, 2])
+            with torch.no_grad():
+                result = loss_fn._target_qvalue_networkN0(
+                    td_q, loss_fn._select_target_qvalue_params(idx)
+                )
+                expected = vmap_qvalue_network(
+                    td_q.clone(), loss_fn.target_qvalue_network_params[idx]
+                )
+            torch.testing.assert_close(
+                result.get("state_action_value"), expected.get("state_action_value")
+            )
+            return result.get("state_action_value")
+
+        before = check_target()
+        for _ in range(2):
+            loss = loss_fn(td.clone())
+            sum(v for k, v in loss.items() if k.startswith("loss_")).backward()
+            optim.step()
+            optim.zero_grad()
+            upd.step()
+            check_target(loss_fn._sample_models_idx())
+        assert not torch.allclose(before, check_target())
+
+        other = DoubleREDQLoss_deprecated(
+            actor_network=self._create_mock_actor(),
+            qvalue_network=deepcopy(qvalue),
+            num_qvalue_nets=4,
+            loss_function="l2",
+        )
+        # the target entropy and value estimator entries are created lazily
+        other(td.clone())
+        with torch.no_grad():
+            other_value = vmap_qvalue_network(
+                td_q.clone(), other.target_qvalue_network_params[torch.tensor([0, 2])]
+            ).get("state_action_value")
+        for assign in (False, True):
+            loss_fn.load_state_dict(other.state_dict(), assign=assign)
+            torch.testing.assert_close(check_target(), other_value)
+
+    def test_redq_deprecated_joint_actor_forward(self):
+        class MeanTanhNormal(TanhNormal):
+            # the sample does not depend on the RNG, which makes the joint and
+            # separate actor passes comparable
+            def rsample(self, sample_shape=None):
+                if sample_shape is None:
+                    sample_shape = torch.Size([])
+                return self.deterministic_sample.expand(
+                    self._extended_shape(sample_shape)
+                )
+
+        torch.manual_seed(self.seed)
+        td = self._create_mock_data_redq()
+        action_spec = Bounded(-torch.ones(4), torch.ones(4), (4,))
+        actor = ProbabilisticActor(
+            module=TensorDictModule(
+                nn.Sequential(nn.Linear(3, 8), NormalParamExtractor()),
+                in_keys=["observation"],
+                out_keys=["loc", "scale"],
+            ),
+            in_keys=["loc", "scale"],
+            distribution_class=MeanTanhNormal,
+            return_log_prob=True,
+            spec=action_spec,
+        )
+        qvalue = self._create_mock_qvalue()
+        loss_fn = REDQLoss_deprecated(
+            actor_network=deepcopy(actor),
+            qvalue_network=deepcopy(qvalue),
+            loss_function="l2",
+            delay_qvalue=False,
+        )
+        loss_fn_joint = REDQLoss_deprecated(
+            actor_network=deepcopy(actor),
+            qvalue_network=deepcopy(qvalue),
+            loss_function="l2",
+            delay_qvalue=False,
+            joint_actor_forward=True,
+        )
+        loss_fn_joint.load_state_dict(loss_fn.state_dict())
+        assert loss_fn._joint_forward(td) == (None, None)
+        assert loss_fn_joint._joint_forward(td)[0] is not None
+
+        td_joint = td.clone()
+        torch.manual_seed(0)
+        loss = loss_fn(td)
+        torch.manual_seed(0)
+        loss_joint = loss_fn_joint(td_joint)
+        for key in ("loss_actor", "loss_qvalue", "loss_alpha"):
+            torch.testing.assert_close(loss[key], loss_joint[key])
+        torch.testing.assert_close(td.get("td_error"), td_joint.get("td_error"))
+
+        (loss["loss_actor"] + loss["loss_qvalue"]).backward()
+        (loss_joint["loss_actor"] + loss_joint["loss_qvalue"]).backward()
+        for p, p_joint in zip(
+            loss_fn.actor_network_params.values(True, True),
+            loss_fn_joint.actor_network_params.values(True, True),
+        ):
+            torch.testing.assert_close(p.grad, p_joint.grad)
+
+    @pytest.mark.skipif(IS_WINDOWS, reason="windows tests do not support compile")
+    def test_redq_deprecated_compile(self):
+        torch.manual_seed(self.seed)
+        td = self._create_mock_data_redq()
+        actor = self._create_mock_actor()
+        qvalue = self._create_mock_qvalue()
+        loss_fn = REDQLoss_deprecated(
+            actor_network=deepcopy(actor),
+            qvalue_network=deepcopy(qvalue),
+            loss_function="l2",
+            delay_qvalue=False,
+        )
+        loss_fn_compiled = REDQLoss_deprecated(
+            actor_network=deepcopy(actor),
+            qvalue_network=deepcopy(qvalue),
+            loss_function="l2",
+            delay_qvalue=False,
+            compile={"backend": "eager"},
+        )
+        loss_fn_compiled.load_state_dict(loss_fn.state_dict())
+
+        torch.manual_seed(0)
+        loss = loss_fn(td.clone())
+        torch.manual_seed(0)
+        loss_compiled = loss_fn_compiled(td.clone())
+        assert_allclose_td(loss, loss_compiled)
+
+    @pytest.mark.parametrize("priority_mode", ["tderr", "quantile"])
+    def test_redq_deprecated_priority_mode(self, priority_mode):
+        torch.manual_seed(self.seed)
+        td = self._create_mock_data_redq()
+        actor = self._create_mock_actor()
+        qvalue = self._create_mock_qvalue()
+        loss_fn = REDQLoss_deprecated(
+            actor_network=actor,
+            qvalue_network=qvalue,
+            loss_function="l2",
+            delay_qvalue=False,
+            priority_mode=priority_mode,
+        )
+        loss_fn(td)
+        td_error = td.get("td_error")
+        assert td_error.shape == td.shape
+        # the priority read by the replay buffer is always the float TD error
+        assert td_error.dtype == torch.float32
+        assert (td_error >= 0).all()
+        if priority_mode == "quantile":
+            td_error_median = td.get("td_error_median")
+            assert td_error_median.shape == td.shape
+            flag = td.get("td_error_above_median")
+            assert flag.dtype == torch.uint8
+            assert set(flag.unique().tolist()) <= {0, 1}
+            assert (flag.bool() == (td_error > td_error_median)).all()
+        else:
+            assert "td_error_median" not in td.keys()
+            assert "td_error_above_median" not in td.keys()
+
+        with pytest.raises(ValueError, match="priority_mode"):
+            REDQLoss_deprecated(
+                actor_network=actor,
+                qvalue_network=qvalue,
+                priority_mode="sum",
+            )
+
+    def test_redq_deprecated_loss_function(self):
+        torch.manual_seed(self.seed)
+        td = self._create_mock_data_redq()
+        loss_fn = REDQLoss_deprecated(
+            actor_network=self._create_mock_actor(),
+            qvalue_network=self._create_mock_qvalue(),
+            loss_function="l2",
+            delay_qvalue=False,
+        )
+        torch.manual_seed(0)
+        loss_l2 = loss_fn(td.clone())["loss_qvalue"]
+        # reassigning the attribute swaps the distance loss
+        loss_fn.loss_function = "l1"
+        assert loss_fn.loss_function == "l1"
+        torch.manual_seed(0)
+        loss_l1 = loss_fn(td.clone())["loss_qvalue"]
+        assert not torch.allclose(loss_l1, loss_l2)
+        with pytest.raises(NotImplementedError, match="Unknown loss"):
+            loss_fn.loss_function = "l3"
+        assert loss_fn.loss_function == "l1"
+
+        with pytest.raises(RuntimeError, match="incompatible"):
+            loss_fn._qvalue_loss_math(
+                torch.zeros(2, 3), torch.zeros(4), loss_fn._loss_fn
+            )
+
+    def test_redq_deprecated_sub_sample_pool(self):
+        torch.manual_seed(self.seed)
+        td = self._create_mock_data_redq()
+        loss_fn = REDQLoss_deprecated(
+            actor_network=self._create_mock_actor(),
+            qvalue_network=self._create_mock_qvalue(),
+            num_qvalue_nets=6,
+            sub_sample_len=3,
+            sub_sample_pool_size=4,
+            delay_qvalue=False,
+        )
+        for i in range(6):
+            loss_fn(td)
+            assert loss_fn._idx_ptr == i % 4 + 1
+        pool = loss_fn._idx_pool
+        assert pool.shape == (4, 3)
+        assert (pool.diff(dim=-1) > 0).all()
+        assert ((pool >= 0) & (pool < 6)).all()
+
+        with pytest.raises(ValueError, match="sub_sample_pool_size"):
+            REDQLoss_deprecated(
+                actor_network=self._create_mock_actor(),
+                qvalue_network=self._create_mock_qvalue(),
+                sub_sample_pool_size=-1,
+            )
+
+    @pytest.mark.parametrize("mlp", [True, False])
+    def test_redq_deprecated_target_dtype(self, mlp):
+        torch.manual_seed(self.seed)
+        td = self._create_mock_data_redq()
+        if mlp:
+            qvalue = self._create_mock_mlp_qvalue()
+        else:
+            qvalue = self._create_mock_qvalue()
+        loss_fn = REDQLoss_deprecated(
+            actor_network=self._create_mock_actor(),
+            qvalue_network=qvalue,
+            loss_function="l2",
+            delay_qvalue=False,
+            target_dtype=torch.bfloat16,
+        )
+        assert (loss_fn._bmm_qvalue_network is not None) is mlp
+        if mlp:
+            # each leaf is cast before the batched matmuls
+            params = loss_fn._select_target_qvalue_params(torch.tensor([0, 1]))
+            assert all(p.dtype == torch.bfloat16 for p in params)
+            out = loss_fn._target_qvalue_networkN0(
+                td.select(*qvalue.in_keys).apply(loss_fn._to_target_dtype), params
+            )
+            assert out.get("state_action_value").dtype == torch.bfloat16
+        loss = loss_fn(td)
+        for key, value in loss.items():
+            assert value.dtype == torch.float32, key
+            assert value.isfinite().all(), key
+        sum(item for key, item in loss.items() if key.startswith("loss_")).backward()
+
+    @pytest.mark.skipif(
+        not torch.cuda.is_available(), reason="CUDA graphs require a CUDA device"
+    )
+    @pytest.mark.parametrize("mlp", [True, False])
+    def test_redq_deprecated_cudagraphs(self, mlp):
+        torch.manual_seed(self.seed)
+        device = "cuda"
+        td = self._create_mock_data_redq(device=device)
+        actor = self._create_mock_actor(device=device)
+        if mlp:
+            qvalue = self._create_mock_mlp_qvalue(device=device)
+        else:
+            qvalue = self._create_mock_qvalue(device=device)
+        loss_fn = REDQLoss_deprecated(
+            actor_network=deepcopy(actor),
+            qvalue_network=deepcopy(qvalue),
+            num_qvalue_nets=4,
+            loss_function="l2",
+        )
+        loss_fn_graph = REDQLoss_deprecated(
+            actor_network=deepcopy(actor),
+            qvalue_network=deepcopy(qvalue),
+            num_qvalue_nets=4,
+            loss_function="l2",
+            cudagraphs=True,
+        )
+        loss_fn_graph.load_state_dict(loss_fn.state_dict())
+        # the bmm path is called with a list of leaves, the vmap path with a
+        # tensordict of indexed params
+        assert (loss_fn_graph._bmm_qvalue_network is not None) is mlp
+
+        with torch.no_grad():
+            next_td = actor(td.get("next").select("observation").clone())
+        next_td = next_td.select(*qvalue.in_keys)
+        # the first calls are eager warmups, the following ones replay the graph
+        for _ in range(4):
+            idx = loss_fn._sample_models_idx()
+            with torch.no_grad():
+                expected = loss_fn._target_qvalue_networkN0(
+                    next_td.clone(), loss_fn._select_target_qvalue_params(idx)
+                )
+                result = loss_fn_graph._target_qvalue_networkN0(
+                    next_td.clone(), loss_fn_graph._select_target_qvalue_params(idx)
+                )
+            torch.testing.assert_close(
+                result.get("state_action_value"), expected.get("state_action_value")
+            )
+
+        for _ in range(4):
+            torch.manual_seed(0)
+            loss = loss_fn(td.clone())
+            torch.manual_seed(0)
+            loss_graph = loss_fn_graph(td.clone())
+            assert_allclose_td(loss, loss_graph)
+
+    @pytest.mark.skipif(torch.cuda.is_available(), reason="CUDA is available")
+    def test_redq_deprecated_cudagraphs_no_cuda(self):
+        with pytest.raises(RuntimeError, match="cudagraphs=True requires a CUDA"):
+            REDQLoss_deprecated(
+                actor_network=self._create_mock_actor(),
+                qvalue_network=self._create_mock_qvalue(),
+                cudagraphs=True,
+            )
+
     @pytest.mark.parametrize("delay_qvalue", (True, False))
     @pytest.mark.parametrize("num_qvalue", [1, 2, 4, 8])
     @pytest.mark.parametrize("device", get_default_devices())
@@ -7,17 +7,25 @@ from __future__ import annotations
 import math
 from dataclasses import dataclass
 from numbers import Number
+from typing import Callable
 
 import numpy as np
 import torch
 from tensordict import TensorDict, TensorDictBase, TensorDictParams
-from tensordict.nn import composite_lp_aggregate, dispatch, TensorDictModule
+from tensordict.nn import (
+    composite_lp_aggregate,
+    CudaGraphModule,
+    dispatch,
+    TensorDictModule,
+)
 from tensordict.utils import NestedKey
-from torch import Tensor
+from torch import nn, Tensor
+from torch.nn import functional as F
 
 from torchrl.data.tensor_specs import Composite
 from torchrl.envs.utils import ExplorationType, set_exploration_type, step_mdp
-from torchrl.objectives import default_value_kwargs, distance_loss, ValueEstimators
+from torchrl.modules.models.models import MLP
+from torchrl.objectives import default_value_kwargs, ValueEstimators
 from torchrl.objectives.common import LossModule
 from torchrl.objectives.utils import (
     _cache_values,
@@ -27,6 +35,171 @@ from torchrl.objectives.utils import (
 )
 from torchrl.objectives.value import TD0Estimator, TD1Estimator, TDLambdaEstimator
 
+_DISTANCE_LOSSES = {
+    "l2": F.mse_loss,
+    "l1": F.l1_loss,
+    "smooth_l1": F.smooth_l1_loss,
+}
+
+# Parameter-free, element-wise layers that can be applied to the stacked ensemble
+# output without any reshaping.
+_BMM_ELEMENTWISE_LAYERS = (
+    nn.ELU,
+    nn.GELU,
+    nn.Identity,
+    nn.LeakyReLU,
+    nn.ReLU,
+    nn.Sigmoid,
+    nn.SiLU,
+    nn.Softplus,
+    nn.Tanh,
+)
+
+
+def _redq_next_state_value(
+    state_action_value: Tensor, sample_log_prob: Tensor, alpha: Tensor
+) -> Tensor:
+    """Soft next-state value, pessimistic over the sub-sampled ensemble."""
+    next_state_value = state_action_value - alpha * sample_log_prob
+    return next_state_value.amin(0)
+
+
+def _redq_qvalue_loss(
+    pred_val: Tensor, target_value: Tensor, loss_fn: Callable
+) -> tuple[Tensor, Tensor]:
+    """Q-value loss and priority (max TD error over the ensemble)."""
+    if target_value.shape != pred_val.shape[1:]:
+        raise RuntimeError(
+            f"The predicted and target values have shapes {pred_val.shape} and "
+            f"{target_value.shape} which are incompatible."
+        )
+    # the difference is a fresh tensor: taking its absolute value in place
+    # saves an (N, B) allocation
+    td_error = (pred_val - target_value).detach().abs_()
+    # the target is broadcast over the ensemble as a stride-0 view
+    loss_qval = loss_fn(
+        pred_val, target_value.unsqueeze(0).expand_as(pred_val), reduction="none"
+    )
+    return loss_qval, td_error.amax(0)
+
+
+def _has_forward_hooks(module: nn.Module) -> bool:
+    return bool(module._forward_hooks or module._forward_pre_hooks)
+
+
+class _BmmEnsembleQ:
+    """Runs an ensemble of MLP Q-value networks with one batched matmul per layer.
+
+    This is a drop-in replacement for ``_vmap_func(qvalue_network, (None, 0))``:
+    it is called with a tensordict shared across the ensemble and a set of
+    parameters with a leading ensemble dimension ``N``. The inputs are concatenated
+    to a ``(B, in)`` tensor, broadcast to ``(N, B, in)`` and every linear layer
+    is executed as ``torch.baddbmm(bias, x, weight.mT)``.
+
+    The returned tensordict has a batch-size ``[N, *tensordict.batch_size]`` and
+    only contains the output key of the Q-value network.
+
+    The parameters can also be passed as a flat list of tensors ordered as
+    :attr:`param_keys` through :meth:`call_with_leaves`, which skips the
+    tensordict lookups.
+
+    Use :meth:`from_module` to build an instance: ``None`` is returned whenever
+    the network cannot be expressed as a stack of :class:`~torch.nn.Linear` and
+    element-wise layers, in which case :func:`~torch.vmap` should be used.
+    """
+
+    def __init__(
+        self,
+        in_keys: list[NestedKey],
+        out_key: NestedKey,
+        layers: list[tuple[NestedKey, bool] | nn.Module],
+    ):
+        self.in_keys = in_keys
+        self.out_key = out_key
+        self.layers = layers
+        param_keys = []
+        for layer in layers:
+            if isinstance(layer, tuple):
+                prefix, has_bias = layer
+                param_keys.append((*prefix, "weight"))
+                if has_bias:
+                    param_keys.append((*prefix, "bias"))
+        self.param_keys = param_keys
+
+    @classmethod
+    def from_module(cls, qvalue_network: nn.Module) -> _BmmEnsembleQ | None:
+        if not isinstance(qvalue_network, TensorDictModule):
+            return None
+        if type(qvalue_network).forward is not TensorDictModule.forward:
+            return None
+        if len(qvalue_network.out_keys) != 1:
+            return None
+        net = qvalue_network.module
+        # hooks (e.g. weight_norm) are bypassed by the batched matmuls
+        if _has_forward_hooks(qvalue_network) or _has_forward_hooks(net):
+            return None
+        if isinstance(net, MLP):
+            if type(net).forward is not MLP.forward or net._reshape_out:
+                return None
+        elif type(net) is nn.Sequential:
+            # a plain sequential does not concatenate its inputs
+            if len(qvalue_network.in_keys) != 1:
+                return None
+        else:
+            return None
+        layers = []
+        for name, layer in net.named_children():
+            if _has_forward_hooks(layer):
+                return None
+            if type(layer) is nn.Linear:
+                has_bias = layer.bias is not None
+                param_names = {key for key, _ in layer.named_parameters()}
+                if param_names != ({"weight", "bias"} if has_bias else {"weight"}):
+                    return None
+                layers.append((("module", name), has_bias))
+            elif type(layer) in _BMM_ELEMENTWISE_LAYERS:
+                layers.append(layer)
+            else:
+                return None
+        if not any(isinstance(layer, tuple) for layer in layers):
+            return None
+        return cls(list(qvalue_network.in_keys), qvalue_network.out_keys[0], layers)
+
+    def __call__(
+        self, tensordict: TensorDictBase, params: TensorDictBase
+    ) -> TensorDictBase:
+        return self.call_with_leaves(
+            tensordict, [params.get(key) for key in self.param_keys]
+        )
+
+    def call_with_leaves(
+        self, tensordict: TensorDictBase, leaves: list[Tensor]
+    ) -> TensorDictBase:
+        inputs = [tensordict.get(key) for key in self.in_keys]
+        x = torch.cat(inputs, -1) if len(inputs) > 1 else inputs[0]
+        lead_shape = x.shape[:-1]
+        x = x.reshape(1, -1, x.shape[-1])
+        leaves = iter(leaves)
+        for layer in self.layers:
+            if isinstance(layer, tuple):
+                _, has_bias = layer
+                weight = next(leaves)
+                x = x.expand(weight.shape[0], *x.shape[1:])
+                if has_bias:
+                    bias = next(leaves)
+                    x = torch.baddbmm(bias.unsqueeze(-2), x, weight.transpose(-2, -1))
+                else:
+                    x = torch.bmm(x, weight.transpose(-2, -1))
+            else:
+                x = layer(x)
+        num_nets = x.shape[0]
+        out = x.reshape(num_nets, *lead_shape, x.shape[-1])
+        return TensorDict(
+            {self.out_key: out},
+            batch_size=[num_nets, *tensordict.batch_size],
+            device=tensordict.device,
+        )
+
 
 class REDQLoss_deprecated(LossModule):
     """REDQ Loss module.
@@ -53,6 +226,12 @@ class REDQLoss_deprecated(LossModule):
         sub_sample_len (int, optional): number of Q-value networks to be
             subsampled to evaluate the next state value
             Default is ``2``.
+        sub_sample_pool_size (int, optional): if greater than ``0``, the indices of the
+            subsampled Q-value networks are drawn ahead of time for that many
+            steps in a single vectorized call, and consumed one step at a time.
+            The draws then depend on the RNG state at the time the pool is
+            refilled rather than at each call.
+            Default is ``0`` (indices are drawn at every call).
         loss_function (str, optional): loss function to be used for the Q-value.
             Can be one of  ``"smooth_l1"``, ``"l2"``,
             ``"l1"``, Default is ``"smooth_l1"``.
@@ -88,6 +267,47 @@ class REDQLoss_deprecated(LossModule):
             elements in the output, ``"sum"``: the output will be summed. Default: ``"mean"``.
         deactivate_vmap (bool, optional): whether to deactivate vmap calls and replace them with a plain for loop.
             Defaults to ``False``.
+
+            .. note:: Q-value networks built as a :class:`~torchrl.modules.MLP` (or a
+              :class:`~torch.nn.Sequential` of linear and element-wise layers) are
+              evaluated with batched matrix multiplications and do not rely on vmap.
+        priority_mode (str, optional): ``"tderr"`` writes the absolute TD error,
+            maximized over the ensemble, under ``"td_error"``. ``"quantile"``
+            additionally writes the batch median of that TD error under the
+            ``priority_median`` key and a ``torch.uint8`` flag indicating whether
+            each TD error is above the median under the ``priority_quantile`` key.
+            Defaults to ``"tderr"``.
+
+            .. warning:: The quantile flag is incompatible with
+              :class:`~torchrl.data.PrioritizedSampler`: with a priority of ``0``
+              the samples below the median would never be sampled again and their
+              importance weights would diverge. The flag is therefore never written
+              under ``"td_error"``, and it must not be used as the ``priority_key``
+              of a prioritized replay buffer.
+        compile (bool or dict of kwargs, optional): if ``True``, the tensor-only
+            part of the Q-value loss (next-state value, distance loss and
+            priority) will be compiled with :func:`~torch.compile`. Keyword
+            arguments can also be passed to torch.compile with this arg.
+            Defaults to ``False``.
+        target_dtype (torch.dtype, optional): if provided, the gradient-free
+            forward of the sub-sampled target Q-value networks is executed in
+            that dtype (e.g. ``torch.bfloat16``). The next state value is cast
+            back to the dtype of the log-probability before the value estimator
+            is called. Defaults to ``None`` (no cast).
+        cudagraphs (bool, optional): if ``True``, the gradient-free forward of the
+            sub-sampled target Q-value networks is captured in a CUDA graph with
+            :class:`~tensordict.nn.CudaGraphModule` and replayed at every call.
+            This requires the data and parameters to live on a CUDA device and
+            the batch size to be constant. A ``RuntimeError`` is raised if CUDA is
+            not available. Defaults to ``False``.
+        joint_actor_forward (bool, optional): if ``True`` and the actor is not
+            delayed, the actor is executed once over the concatenation of the
+            current and next observations instead of twice. This saves a kernel
+            launch per layer at the cost of running the next-observation half
+            within the autograd graph: the actor activations stored for the
+            backward pass double and the backward pass traverses both halves. The
+            order of the random draws also differs from the separate passes.
+            Defaults to ``False``.
     """
 
     @dataclass
@@ -108,6 +328,12 @@ class REDQLoss_deprecated(LossModule):
                 Defaults to ``"_log_prob"``.
             priority (NestedKey): The input tensordict key where the target priority is written to.
                 Defaults to ``"td_error"``.
+            priority_median (NestedKey): The input tensordict key where the batch median of
+                the priority is written to when ``priority_mode="quantile"``.
+                Defaults to ``"td_error_median"``.
+            priority_quantile (NestedKey): The input tensordict key where the
+                above-median flag is written to when ``priority_mode="quantile"``.
+                Defaults to ``"td_error_above_median"``.
             reward (NestedKey): The input tensordict key where the reward is expected.
                 Will be used for the underlying value estimator. Defaults to ``"reward"``.
             done (NestedKey): The key in the input TensorDict that indicates
@@ -123,6 +349,8 @@ class REDQLoss_deprecated(LossModule):
         value: NestedKey = "state_value"
         log_prob: NestedKey | None = None
         priority: NestedKey = "td_error"
+        priority_median: NestedKey = "td_error_median"
+        priority_quantile: NestedKey = "td_error_above_median"
         reward: NestedKey = "reward"
         done: NestedKey = "done"
         terminated: NestedKey = "terminated"
@@ -153,6 +381,7 @@ class REDQLoss_deprecated(LossModule):
         *,
         num_qvalue_nets: int = 10,
         sub_sample_len: int = 2,
+        sub_sample_pool_size: int = 0,
         loss_function: str = "smooth_l1",
         alpha_init: float = 1.0,
         min_alpha: float = 0.1,
@@ -167,6 +396,11 @@ class REDQLoss_deprecated(LossModule):
         separate_losses: bool = False,
         reduction: str = None,
         deactivate_vmap: bool = False,
+        priority_mode: str = "tderr",
+        compile: bool | dict = False,
+        target_dtype: torch.dtype | None = None,
+        cudagraphs: bool = False,
+        joint_actor_forward: bool = False,
     ):
         self._in_keys = None
         self._out_keys = None
@@ -176,6 +410,11 @@ class REDQLoss_deprecated(LossModule):
         self._set_deprecated_ctor_keys(priority_key=priority_key)
 
         self.deactivate_vmap = deactivate_vmap
+        if cudagraphs and not torch.cuda.is_available():
+            raise RuntimeError("cudagraphs=True requires a CUDA device.")
+        self.cudagraphs = cudagraphs
+        self.target_dtype = target_dtype
+        self.joint_actor_forward = joint_actor_forward
 
         self.convert_to_functional(
             actor_network,
@@ -201,7 +440,21 @@ class REDQLoss_deprecated(LossModule):
         )
         self.num_qvalue_nets = num_qvalue_nets
         self.sub_sample_len = max(1, min(sub_sample_len, num_qvalue_nets - 1))
+        # uniform weights used to sub-sample the target Q-value networks
+        self._sample_weights = torch.ones(num_qvalue_nets)
+        if sub_sample_pool_size < 0:
+            raise ValueError(
+                f"sub_sample_pool_size must be non-negative, got {sub_sample_pool_size}."
+            )
+        self.sub_sample_pool_size = sub_sample_pool_size
+        self._idx_pool = None
+        self._idx_ptr = 0
         self.loss_function = loss_function
+        if priority_mode not in ("tderr", "quantile"):
+            raise ValueError(
+                f"priority_mode must be one of 'tderr' or 'quantile', got {priority_mode}."
+            )
+        self.priority_mode = priority_mode
 
         try:
             device = next(self.parameters()).device
@@ -235,13 +488,37 @@ class REDQLoss_deprecated(LossModule):
         self._make_vmap()
         self.reduction = reduction
 
+        self._next_state_value = _redq_next_state_value
+        self._qvalue_loss_math = _redq_qvalue_loss
+        if compile:
+            # TensorDict operations are kept out of the compiled region
+            kwargs = compile if isinstance(compile, dict) else {}
+            self._next_state_value = torch.compile(_redq_next_state_value, **kwargs)
+            self._qvalue_loss_math = torch.compile(_redq_qvalue_loss, **kwargs)
+
         if gamma is not None:
             raise TypeError(_GAMMA_LMBDA_DEPREC_ERROR)
+        self._set_in_keys()
 
     def _make_vmap(self):
-        self._vmap_qvalue_networkN0 = _vmap_func(
-            self.qvalue_network, (None, 0), pseudo_vmap=self.deactivate_vmap
-        )
+        # MLP critics are evaluated with batched matmuls, which avoids the
+        # per-layer overhead of vmap. Other networks fall back on vmap.
+        self._bmm_qvalue_network = _BmmEnsembleQ.from_module(self.qvalue_network)
+        if self._bmm_qvalue_network is not None:
+            qvalue_networkN0 = self._bmm_qvalue_network
+            # the target parameters are passed as a list of leaves, see
+            # _select_target_qvalue_params
+            target_qvalue_networkN0 = self._bmm_qvalue_network.call_with_leaves
+        else:
+            qvalue_networkN0 = target_qvalue_networkN0 = _vmap_func(
+                self.qvalue_network, (None, 0), pseudo_vmap=self.deactivate_vmap
+            )
+        self._vmap_qvalue_networkN0 = qvalue_networkN0
+        if self.cudagraphs:
+            # The target ensemble runs without gradients and with fixed shapes,
+            # so its forward can be replayed from a CUDA graph.
+            target_qvalue_networkN0 = CudaGraphModule(target_qvalue_networkN0)
+        self._target_qvalue_networkN0 = target_qvalue_networkN0
 
     @property
     def target_entropy(self):
@@ -251,7 +528,9 @@ class REDQLoss_deprecated(LossModule):
             target_entropy = self._target_entropy
             action_spec = self._action_spec
             actor_network = self.actor_network
-            device = next(self.parameters()).device
+            # log_alpha follows the module across devices and avoids walking
+            # the parameters
+            device = self.log_alpha.device
             if target_entropy == "auto":
                 action_spec = (
                     action_spec
@@ -285,6 +564,19 @@ class REDQLoss_deprecated(LossModule):
             )
         self._set_in_keys()
 
+    @property
+    def loss_function(self) -> str:
+        return self._loss_function
+
+    @loss_function.setter
+    def loss_function(self, value: str) -> None:
+        # the distance loss is resolved here rather than at every call
+        loss_fn = _DISTANCE_LOSSES.get(value)
+        if loss_fn is None:
+            raise NotImplementedError(f"Unknown loss {value}.")
+        self._loss_function = value
+        self._loss_fn = loss_fn
+
     @property
     def alpha(self):
         with torch.no_grad():
@@ -302,7 +594,8 @@ class REDQLoss_deprecated(LossModule):
             *[("next", key) for key in self.actor_network.in_keys],
             *self.qvalue_network.in_keys,
         ]
-        self._in_keys = list(set(keys))
+        # order-preserving deduplication
+        self._in_keys = list(dict.fromkeys(keys))
 
     @property
     def in_keys(self):
@@ -327,30 +620,49 @@ class REDQLoss_deprecated(LossModule):
 
     @dispatch
     def forward(self, tensordict: TensorDictBase) -> TensorDictBase:
-        loss_actor, sample_log_prob = self._actor_loss(tensordict)
+        # alpha is computed once per call: the actor and value losses read the
+        # detached value while the alpha loss differentiates through it.
+        alpha = self.log_alpha.clamp(self.min_log_alpha, self.max_log_alpha).exp()
+        alpha_detach = alpha.detach()
+
+        # A single pass over the input gathers every entry read by the losses.
+        # The priority is still written to the input tensordict.
+        tensordict_select = tensordict.select(
+            "next",
+            *self.actor_network.in_keys,
+            self.tensor_keys.action,
+            *self.qvalue_network.in_keys,
+            strict=False,
+        )
+        tensordict_actor, next_tensordict_actor = self._joint_forward(tensordict_select)
+        loss_actor, sample_log_prob = self._actor_loss(
+            tensordict_select, tensordict_actor, alpha=alpha_detach
+        )
 
-        loss_qval = self._qvalue_loss(tensordict)
-        loss_alpha = self._loss_alpha(sample_log_prob)
+        loss_qval = self._qvalue_loss(
+            tensordict,
+            next_tensordict_actor,
+            alpha=alpha_detach,
+            tensordict_select=tensordict_select,
+        )
+        loss_alpha = self._loss_alpha(sample_log_prob, alpha=alpha)
         if not loss_qval.shape == loss_actor.shape:
             raise RuntimeError(
                 f"QVal and actor loss have different shape: {loss_qval.shape} and {loss_actor.shape}"
             )
+        loss_actor = _reduce(loss_actor, reduction=self.reduction)
+        loss_qval = _reduce(loss_qval, reduction=self.reduction)
+        loss_alpha = _reduce(loss_alpha, reduction=self.reduction)
         td_out = TensorDict(
             {
                 "loss_actor": loss_actor,
                 "loss_qvalue": loss_qval,
                 "loss_alpha": loss_alpha,
-                "alpha": self.alpha,
+                "alpha": alpha_detach,
                 "entropy": -sample_log_prob.detach().mean(),
             },
             [],
         )
-        td_out = td_out.named_apply(
-            lambda name, value: _reduce(value, reduction=self.reduction)
-            if name.startswith("loss_")
-            else value,
-            batch_size=[],
-        )
         self._clear_weakrefs(
             tensordict,
             td_out,
@@ -364,102 +676,232 @@ class REDQLoss_deprecated(LossModule):
     @property
     @_cache_values
     def _cached_detach_qvalue_network_params(self):
+        # The detached tensors share their storage with the parameters, so
+        # in-place optimizer updates are reflected without re-detaching: the
+        # tree walk happens once, until the cache is erased by a call to _apply
+        # (e.g. a device cast).
         return self.qvalue_network_params.detach()
 
-    def _actor_loss(self, tensordict: TensorDictBase) -> tuple[Tensor, Tensor]:
+    def _fast_next_obs(self, tensordict: TensorDictBase) -> TensorDictBase:
+        """Gathers the next observations read by the actor as root entries.
+
+        When all the actor inputs are present under ``"next"``, this is a cheaper
+        equivalent of ``step_mdp(tensordict).select(*actor_in_keys)`` that skips
+        the re-keying of rewards, done states and actions.
+        """
+        obs_keys = self.actor_network.in_keys
+        next_tensordict = tensordict.get("next")
+        next_keys = next_tensordict.keys(True)
+        if all(key in next_keys for key in obs_keys):
+            return next_tensordict.select(*obs_keys)
+        return step_mdp(tensordict).select(*obs_keys, strict=False)
+
+    def _joint_forward(
+        self, tensordict: TensorDictBase
+    ) -> tuple[TensorDictBase | None, TensorDictBase | None]:
+        """Runs the actor once over the current and next observations.
+
+        Without a delayed actor, the target actor parameters are a detached view
+        of the actor parameters: the current and next observations can then be
+        concatenated along the first batch dimension and fed to the actor in a
+        single call. The next-step half of the output is detached.
+
+        Returns ``(None, None)`` unless ``joint_actor_forward`` is set, or whenever
+        the inputs cannot be concatenated, in which case :meth:`_actor_loss` and
+        :meth:`_qvalue_loss` run the actor themselves.
+        """
+        if (
+            not self.joint_actor_forward
+            or self.delay_actor
+            or not tensordict.batch_dims
+        ):
+            return None, None
         obs_keys = self.actor_network.in_keys
         tensordict_clone = tensordict.select(*obs_keys, strict=False)
+        next_td = self._fast_next_obs(tensordict)
+        if set(tensordict_clone.keys(True, True)) != set(next_td.keys(True, True)):
+            return None, None
+        joint_td = torch.cat([tensordict_clone, next_td], 0)
         with set_exploration_type(
             ExplorationType.RANDOM
         ), self.actor_network_params.to_module(self.actor_network):
-            self.actor_network(tensordict_clone)
+            self.actor_network(joint_td)
+        batch = tensordict.shape[0]
+        return joint_td[:batch], joint_td[batch:].detach()
+
+    def _actor_loss(
+        self,
+        tensordict: TensorDictBase,
+        tensordict_actor: TensorDictBase | None = None,
+        alpha: Tensor | None = None,
+    ) -> tuple[Tensor, Tensor]:
+        if alpha is None:
+            alpha = self.alpha
+        log_prob_key = self.tensor_keys.log_prob
+        state_action_value_key = self.tensor_keys.state_action_value
+        if tensordict_actor is None:
+            obs_keys = self.actor_network.in_keys
+            tensordict_actor = tensordict.select(*obs_keys, strict=False)
+            with set_exploration_type(
+                ExplorationType.RANDOM
+            ), self.actor_network_params.to_module(self.actor_network):
+                self.actor_network(tensordict_actor)
 
         tensordict_expand = self._vmap_qvalue_networkN0(
-            tensordict_clone.select(*self.qvalue_network.in_keys, strict=False),
+            tensordict_actor.select(*self.qvalue_network.in_keys, strict=False),
             self._cached_detach_qvalue_network_params,
         )
-        state_action_value = tensordict_expand.get(
-            self.tensor_keys.state_action_value
-        ).squeeze(-1)
-        loss_actor = -(
-            state_action_value
-            - self.alpha * tensordict_clone.get(self.tensor_keys.log_prob).squeeze(-1)
-        )
-        return loss_actor, tensordict_clone.get(self.tensor_keys.log_prob)
+        state_action_value = tensordict_expand.get(state_action_value_key).squeeze(-1)
+        log_prob = tensordict_actor.get(log_prob_key)
+        loss_actor = -(state_action_value - alpha * log_prob.squeeze(-1))
+        return loss_actor, log_prob
 
-    def _qvalue_loss(self, tensordict: TensorDictBase) -> Tensor:
+    def _qvalue_loss(
+        self,
+        tensordict: TensorDictBase,
+        next_tensordict_actor: TensorDictBase | None = None,
+        alpha: Tensor | None = None,
+        *,
+        tensordict_select: TensorDictBase | None = None,
+    ) -> Tensor:
+        if alpha is None:
+            alpha = self.alpha
         tensordict_save = tensordict
+        if tensordict_select is not None:
+            tensordict = tensordict_select
+        state_action_value_key = self.tensor_keys.state_action_value
 
         obs_keys = self.actor_network.in_keys
         tensordict = tensordict.select(
             "next", *obs_keys, self.tensor_keys.action, strict=False
-        ).clone(False)
+        )
 
-        selected_models_idx = torch.randperm(self.num_qvalue_nets)[
-            : self.sub_sample_len
-        ].sort()[0]
+        selected_models_idx = self._sample_models_idx()
         with torch.no_grad():
-            selected_q_params = self.target_qvalue_network_params[selected_models_idx]
-
-            next_td = step_mdp(tensordict).select(
-                *self.actor_network.in_keys, strict=False
-            )  # next_observation ->
-            # observation
-            # select pseudo-action
-            with set_exploration_type(
-                ExplorationType.RANDOM
-            ), self.target_actor_network_params.to_module(self.actor_network):
-                self.actor_network(next_td)
+            selected_q_params = self._select_target_qvalue_params(selected_models_idx)
+
+            if next_tensordict_actor is not None:
+                next_td = next_tensordict_actor
+            else:
+                # next_observation -> observation
+                next_td = self._fast_next_obs(tensordict)
+                # select pseudo-action
+                with set_exploration_type(
+                    ExplorationType.RANDOM
+                ), self.target_actor_network_params.to_module(self.actor_network):
+                    self.actor_network(next_td)
             sample_log_prob = next_td.get(self.tensor_keys.log_prob)
+            # only the Q-value inputs are passed on (and copied to the static
+            # inputs of the CUDA graph, if any)
+            next_td = next_td.select(*self.qvalue_network.in_keys, strict=False)
+            if self.target_dtype is not None:
+                # the target pass is gradient-free and can run in reduced precision
+                next_td = next_td.apply(self._to_target_dtype)
             # get q-values
-            next_td = self._vmap_qvalue_networkN0(
+            next_td = self._target_qvalue_networkN0(
                 next_td,
                 selected_q_params,
             )
-            state_action_value = next_td.get(self.tensor_keys.state_action_value)
+            state_action_value = next_td.get(state_action_value_key)
             if (
                 state_action_value.shape[-len(sample_log_prob.shape) :]
                 != sample_log_prob.shape
             ):
                 sample_log_prob = sample_log_prob.unsqueeze(-1)
-            next_state_value = (
-                next_td.get(self.tensor_keys.state_action_value)
-                - self.alpha * sample_log_prob
+            next_state_value = self._next_state_value(
+                state_action_value,
+                sample_log_prob,
+                alpha,
             )
-            next_state_value = next_state_value.min(0)[0]
 
+        # select() returns a new root but shares the "next" sub-tensordict with
+        # the input: only that level is copied before writing the next value.
+        tensordict.set("next", tensordict.get("next").copy())
+        next_state_value = next_state_value.to(sample_log_prob.dtype)
         tensordict.set(("next", self.tensor_keys.value), next_state_value)
         target_value = self.value_estimator.value_estimate(tensordict).squeeze(-1)
         tensordict_expand = self._vmap_qvalue_networkN0(
             tensordict.select(*self.qvalue_network.in_keys, strict=False),
             self.qvalue_network_params,
         )
-        pred_val = tensordict_expand.get(self.tensor_keys.state_action_value).squeeze(
-            -1
-        )
-        td_error = abs(pred_val - target_value)
-        loss_qval = distance_loss(
-            pred_val,
-            target_value.expand_as(pred_val),
-            loss_function=self.loss_function,
+        pred_val = tensordict_expand.get(state_action_value_key).squeeze(-1)
+        loss_qval, td_error = self._qvalue_loss_math(
+            pred_val, target_value, self._loss_fn
         )
-        tensordict_save.set("td_error", td_error.detach().max(0)[0])
+        if self.priority_mode == "quantile":
+            # scale-invariant prioritization: only the position of each TD error
+            # relative to the batch median is kept. The flag has its own key as a
+            # zero priority would starve the PrioritizedSampler.
+            td_error_median = td_error.median()
+            tensordict_save.set(
+                self.tensor_keys.priority_median, td_error_median.expand_as(td_error)
+            )
+            tensordict_save.set(
+                self.tensor_keys.priority_quantile,
+                (td_error > td_error_median).to(torch.uint8),
+            )
+        tensordict_save.set("td_error", td_error)
         return loss_qval
 
-    def _loss_alpha(self, log_pi: Tensor) -> Tensor:
+    @property
+    @_cache_values
+    def _cached_target_qvalue_leaves(self):
+        # The leaves are updated in place by the target updaters and the
+        # optimizer, and load_state_dict copies into them (or keeps them with
+        # assign=True), so they only need to be gathered once until _apply
+        # erases the cache. The missing-updater warning is still issued at every
+        # call by the forward pre-hook.
+        target_params = self.target_qvalue_network_params
+        return [target_params.get(key) for key in self._bmm_qvalue_network.param_keys]
+
+    def _select_target_qvalue_params(
+        self, selected_models_idx: Tensor
+    ) -> TensorDictBase | list[Tensor]:
+        if self._bmm_qvalue_network is not None:
+            # index each pre-gathered leaf rather than the whole tensordict
+            params = [p[selected_models_idx] for p in self._cached_target_qvalue_leaves]
+            if self.target_dtype is not None:
+                params = [self._to_target_dtype(p) for p in params]
+            return params
+        params = self.target_qvalue_network_params[selected_models_idx]
+        if self.target_dtype is not None:
+            params = params.apply(self._to_target_dtype)
+        return params
+
+    def _to_target_dtype(self, tensor: Tensor) -> Tensor:
+        if tensor.is_floating_point():
+            return tensor.to(self.target_dtype)
+        return tensor
+
+    def _sample_models_idx(self) -> Tensor:
+        pool_size = self.sub_sample_pool_size
+        if not pool_size:
+            return torch.multinomial(
+                self._sample_weights, self.sub_sample_len, replacement=False
+            ).sort()[0]
+        if self._idx_pool is None or self._idx_ptr == pool_size:
+            # one vectorized draw covers the next pool_size steps
+            self._idx_pool = torch.multinomial(
+                self._sample_weights.expand(pool_size, -1),
+                self.sub_sample_len,
+                replacement=False,
+            ).sort(-1)[0]
+            self._idx_ptr = 0
+        selected_models_idx = self._idx_pool[self._idx_ptr]
+        self._idx_ptr += 1
+        return selected_models_idx
+
+    def _loss_alpha(self, log_pi: Tensor, alpha: Tensor | None = None) -> Tensor:
         if torch.is_grad_enabled() and not log_pi.requires_grad:
             raise RuntimeError(
                 "expected log_pi to require gradient for the alpha loss)"
             )
-        if self.target_entropy is not None:
-            # we can compute this loss even if log_alpha is not a parameter
-            alpha_loss = -self.log_alpha.clamp(
-                self.min_log_alpha, self.max_log_alpha
-            ).exp() * (log_pi.detach() + self.target_entropy)
-        else:
-            # placeholder
-            alpha_loss = torch.zeros_like(log_pi)
-        return alpha_loss
+        # the target entropy property is resolved once per call
+        target_entropy = self.target_entropy
+        # we can compute this loss even if log_alpha is not a parameter
+        if alpha is None:
+            alpha = self.log_alpha.clamp(self.min_log_alpha, self.max_log_alpha).exp()
+        return -alpha * (log_pi.detach() + target_entropy)
 
     def make_value_estimator(self, value_type: ValueEstimators = None, **hyperparams):
         if value_type is None: